@@ -0,0 +1,32 @@
+import json
+from pathlib import Path
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def load_json(s):
+    # orjson rejects some documents the json module accepts (e.g. NaN and Infinity), so
+    # fall back to json rather than failing the test
+    if orjson is not None:
+        try:
+            return orjson.loads(s)
+        except ValueError:
+            pass
+    return json.loads(s)
+
+
+def dump_json(obj) -> str:
+    # orjson cannot serialize some values the json module can (e.g. integers over 64 bits)
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj).decode()
+        except TypeError:
+            pass
+    return json.dumps(obj, separators=(",", ":"))
+
+
+def load_configs(test_config: Path) -> list:
+    return load_json(test_config.read_bytes())
@@ -0,0 +1,107 @@
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from enum import Enum
+import logging
+import os
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from _config_cache import dump_json, load_configs, load_json
+
+
+class Result(Enum):
+    PASS = "pass"
+    WARN = "warn"
+    FAIL = "fail"
+    INVALID = "invalid"
+    IGNORE = "ignore"
+
+
+RESULT_IDX = {r: i for i, r in enumerate(Result)}
+
+
+def get_filename_if_path(val):
+    # miniwdl reports File outputs as absolute paths into its run directory, while tests
+    # expect just the file name
+    if isinstance(val, str):
+        if val.startswith("/"):
+            return val.rsplit("/", 1)[-1]
+        return val
+    elif isinstance(val, list):
+        return [get_filename_if_path(v) for v in val]
+    elif isinstance(val, dict):
+        return {k: get_filename_if_path(v) for k, v in val.items()}
+    else:
+        return val
+
+
+def find_invalid_outputs(output: dict, config: dict) -> list:
+    expected_outputs = config.get("output") or {}
+    exclude_output = config.get("exclude_output") or ()
+    if isinstance(exclude_output, str):
+        exclude_output = (exclude_output,)
+    excluded = frozenset(exclude_output)
+
+    invalid = []
+    for key, value in output.items():
+        if key in excluded:
+            continue
+        if key not in expected_outputs:
+            invalid.append((key, value, None))
+            continue
+        expected_value = expected_outputs[key]
+        # Only strings and collections can contain paths that need normalizing
+        if isinstance(expected_value, (str, list, dict)):
+            matches = get_filename_if_path(value) == expected_value
+        else:
+            matches = value == expected_value
+        if not matches:
+            invalid.append((key, value, expected_value))
+    return invalid
+
+
+def build_argparser() -> ArgumentParser:
+    parser = ArgumentParser()
+    parser.add_argument("-T", "--test-dir", type=Path, default=Path("."))
+    parser.add_argument("-c", "--test-config", type=Path, default=None)
+    parser.add_argument("-D", "--data-dir", type=Path, default=None)
+    parser.add_argument("-O", "--output-dir", type=Path, default=None)
+    parser.add_argument("-n", "--num-tests", type=int, default=None)
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--check-only", action="store_true", default=False)
+    parser.add_argument("--strict", action="store_true", default=False)
+    parser.add_argument("--no-warn", action="store_true", default=False)
+    parser.add_argument("--deprecated-optional", action="store_true", default=False)
+    parser.add_argument("-v", "--verbose", action="store_true", default=False)
+    return parser
+
+
+def configure_logging(verbose: bool):
+    logging.basicConfig(
+        level=logging.DEBUG if verbose else logging.WARNING, format="%(message)s"
+    )
+
+
+def run_suite(
+    batches: List[List[dict]],
+    test_fn: Callable[[List[dict]], List[Result]],
+    jobs: Optional[int],
+) -> List[int]:
+    # Tests are independent and spend their time waiting on the runner subprocess, so they
+    # are run concurrently in threads. Counts are only updated on the calling thread.
+    counts = [0] * len(Result)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(test_fn, batch) for batch in batches]
+        for future in as_completed(futures):
+            for result in future.result():
+                counts[RESULT_IDX[result]] += 1
+    return counts
+
+
+def summarize(counts: List[int]):
+    print(f"Total tests: {sum(counts)}")
+    print(f"Passed: {counts[RESULT_IDX[Result.PASS]]}")
+    print(f"Warnings: {counts[RESULT_IDX[Result.WARN]]}")
+    print(f"Failures: {counts[RESULT_IDX[Result.FAIL]]}")
+    print(f"Invalid outputs: {counts[RESULT_IDX[Result.INVALID]]}")
+    print(f"Ignored: {counts[RESULT_IDX[Result.IGNORE]]}")
@@ -1,29 +1,72 @@
 #!/usr/bin/env python3
 from argparse import ArgumentParser
 import json
+import mmap
+import os
 from pathlib import Path
 import re
 import shutil
-from typing import Optional
+from typing import Optional, Tuple
 
 
-TEST_RE = re.compile(
-    r"^<details>\s*<summary>\s*Example: (.+?)\s*```wdl(.+?)```\s*</summary>\s*(?:<p>\s*(?:Example input:\s*```json(.*?)```)?\s*(?:Example output:\s*```json(.*?)```)?\s*(?:Test config:\s*```json(.*)```)?\s*</p>\s*)?</details>$",
-    re.I | re.S,
+DETAILS_RE = re.compile(rb"<details>(.*?)</details>", re.I | re.S)
+SUMMARY_RE = re.compile(
+    r"\s*<summary>\s*Example: (\S+?)\s*```wdl(.+?)```\s*</summary>\s*", re.I | re.S
+)
+PARAGRAPH_RE = re.compile(r"<p>(.*)</p>\s*", re.I | re.S)
+INPUT_RE = re.compile(r"\s*Example input:\s*```json(.*?)```", re.I | re.S)
+OUTPUT_RE = re.compile(r"\s*Example output:\s*```json(.*?)```", re.I | re.S)
+CONFIG_RE = re.compile(r"\s*Test config:\s*```json(.*)```", re.I | re.S)
+FILENAME_RE = re.compile(
+    r"(?P<target>[A-Za-z0-9_\-]+?)(?P<fail>_fail)?(?P<task>_task)?\.wdl"
 )
-FILENAME_RE = re.compile(r"(.+?)(_fail)?(_task)?.wdl")
 VERSION_RE = re.compile(r"version ([\d.]+)")
 
 
-def write_test_files(m: re.Match, output_dir: Path, version: str, config: list):
-    file_name, wdl, input_json, output_json, config_json = m.groups()
+def match_example(body: str) -> Optional[Tuple[Optional[str], ...]]:
+    # Matches the contents of a details element in stages - summary, then each optional
+    # section of the paragraph in order - rather than with a single pattern.
+    s = SUMMARY_RE.match(body)
+    if s is None:
+        return None
+    file_name, wdl = s.groups()
+
+    sections = []
+    rest = body[s.end() :]
+    if rest:
+        p = PARAGRAPH_RE.fullmatch(rest)
+        if p is None:
+            return None
+        para = p.group(1)
+        pos = 0
+        for section_re in (INPUT_RE, OUTPUT_RE, CONFIG_RE):
+            m = section_re.match(para, pos)
+            if m is None:
+                sections.append(None)
+            else:
+                sections.append(m.group(1))
+                pos = m.end()
+        if para[pos:].strip():
+            return None
+    else:
+        sections = [None, None, None]
+
+    return (file_name, wdl, *sections)
+
+
+def write_test_files(
+    groups: Tuple[Optional[str], ...], output_dir: Path, version: str, config: list
+):
+    file_name, wdl, input_json, output_json, config_json = groups
 
     if file_name is None:
         raise Exception("Missing file name")
-    f = FILENAME_RE.match(file_name)
+    f = FILENAME_RE.fullmatch(file_name)
     if f is None:
         raise Exception(f"Invalid file name: {file_name}")
-    target, is_fail, is_task = f.groups()
+    target = f.group("target")
+    is_fail = f.group("fail")
+    is_task = f.group("task")
 
     wdl = wdl.strip()
     v = VERSION_RE.search(wdl)
@@ -35,8 +78,7 @@ def write_test_files(m: re.Match, output_dir: Path, version: str, config: list):
     wdl_file = output_dir / file_name
     if wdl_file.exists():
         raise Exception(f"Test file already exists: {wdl_file}")
-    with open(wdl_file, "w") as o:
-        o.write(wdl)
+    wdl_file.write_text(wdl)
 
     if config_json is not None:
         config_entry = json.loads(config_json)
@@ -87,39 +129,49 @@ def write_test_files(m: re.Match, output_dir: Path, version: str, config: list):
     config.append(config_entry)
 
 
+def link_or_copy(src: str, dst: str):
+    # Hard links share the data with the source directory; fall back to copying if the
+    # output directory is on a different file system.
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
 def extract_tests(spec: Path, data_dir: Optional[Path], output_dir: Path, version: str):
     if not output_dir.exists():
         output_dir.mkdir(parents=True)
 
     config = []
-    with open(spec) as s:
-        buf = None
-        for line in s:
-            if buf is None and "<details>" in line:
-                buf = [line]
-            elif buf is not None:
-                buf.append(line)
-                if "</details>" in line:
-                    ex = "".join(buf)
-                    buf = None
-                    m = TEST_RE.match(ex)
+    with open(spec, "rb") as s:
+        if spec.stat().st_size > 0:
+            with mmap.mmap(s.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for d in DETAILS_RE.finditer(mm):
+                    m = match_example(d.group(1).decode())
                     if m is None:
-                        raise Exception(f"Regex does not match example {ex}")
-                    else:
-                        try:
-                            write_test_files(m, output_dir, version, config)
-                        except Exception as e:
-                            raise Exception(
-                                f"Error writing files for example {ex}"
-                            ) from e
+                        raise Exception(
+                            f"Regex does not match example {d.group(0).decode()}"
+                        )
+                    try:
+                        write_test_files(m, output_dir, version, config)
+                    except Exception as e:
+                        raise Exception(
+                            f"Error writing files for example {d.group(0).decode()}"
+                        ) from e
 
     config_file = output_dir / "test_config.json"
-    with open(config_file, "w") as o:
-        json.dump(config, o, indent=2)
+    config_file.write_text(json.dumps(config, indent=2))
 
     if data_dir is not None and data_dir.exists():
         output_data_dir = output_dir / "data"
-        shutil.copytree(data_dir, output_data_dir, symlinks=True, dirs_exist_ok=False)
+        if not (output_data_dir.exists() and data_dir.samefile(output_data_dir)):
+            shutil.copytree(
+                data_dir,
+                output_data_dir,
+                symlinks=True,
+                copy_function=link_or_copy,
+                dirs_exist_ok=False,
+            )
 
 
 def main():
@@ -1,48 +1,63 @@
 #!/usr/bin/env python3
-from argparse import ArgumentParser
-from collections import defaultdict
-from enum import Enum
-import json
+import functools
+import logging
+import math
 import os
 from pathlib import Path
 import shutil
-import subby
-from typing import Optional
+import stat
+import subprocess
+from typing import List, Optional
 
+from _runner_common import (
+    Result,
+    build_argparser,
+    configure_logging,
+    dump_json,
+    find_invalid_outputs,
+    load_configs,
+    load_json,
+    run_suite,
+    summarize,
+)
 
-class Result(Enum):
-    PASS = "pass"
-    WARN = "warn"
-    FAIL = "fail"
-    INVALID = "invalid"
-    IGNORE = "ignore"
+log = logging.getLogger(__name__)
 
+# Maximum number of files passed to a single `miniwdl check` invocation
+CHECK_BATCH_SIZE = 64
 
+
+@functools.lru_cache(maxsize=None)
 def resolve_miniwdl(path: Optional[Path]) -> Path:
     if path is None:
-        path = Path(shutil.which("miniwdl"))
-    if path is None:
-        raise Exception("Cannot find miniwdl on system path")
-    if not path.exists():
-        raise Exception(f"Executable does not exist: {path}")
-    if not os.access(path, os.X_OK):
+        found = shutil.which("miniwdl")
+        if found is None:
+            raise Exception("Cannot find miniwdl on system path")
+        return Path(found)
+    try:
+        mode = os.stat(path).st_mode
+    except OSError as e:
+        raise Exception(f"Cannot access executable: {path}") from e
+    # os.access checks the permissions that apply to the current user
+    if not stat.S_ISREG(mode) or not os.access(path, os.X_OK):
         raise Exception(f"Path is not executable: {path}")
     return path
 
 
 def check(
     config: dict,
-    miniwdl_path: Path,
-    test_dir: Path,
+    miniwdl_path: str,
+    test_dir: str,
     strict: bool,
     no_warn: bool,
     deprecated_optional: bool,
 ) -> Result:
-    command = [str(miniwdl_path), "check"]
+    command = [miniwdl_path, "check"]
     if strict:
         command.append("--strict")
     command.append(str(config["path"]))
-    p = subby.cmd(command, shell=True, cwd=test_dir, raise_on_error=False)
+    log.debug("Executing: %s", command)
+    p = subprocess.run(command, cwd=test_dir, capture_output=True, text=True)
     if p.returncode == 0:
         return Result.PASS
     elif config["priority"] == "ignore":
@@ -54,34 +69,76 @@ def check(
     else:
         fail = config["fail"]
         title = f"{config['path']}: {'WARNING' if fail else 'ERROR'}"
-        print(title)
-        print("-" * len(title))
-        print(p.output or p.error)
-        print()
+        # Print the report in one call so reports from concurrent tests don't interleave
+        print("\n".join([title, "-" * len(title), p.stdout or p.stderr, ""]))
         return Result.WARN if fail else Result.FAIL
 
 
+def check_batch(
+    configs: List[dict],
+    miniwdl_path: str,
+    test_dir: str,
+    strict: bool,
+    no_warn: bool,
+    deprecated_optional: bool,
+) -> List[Result]:
+    if len(configs) == 1:
+        return [
+            check(
+                configs[0], miniwdl_path, test_dir, strict, no_warn, deprecated_optional
+            )
+        ]
+    # Check all the files with a single miniwdl invocation. miniwdl does not report which
+    # file failed, so if any did the batch is split in half and each half checked again.
+    command = [miniwdl_path, "check"]
+    if strict:
+        command.append("--strict")
+    command.extend(str(config["path"]) for config in configs)
+    log.debug("Executing: %s", command)
+    p = subprocess.run(command, cwd=test_dir, capture_output=True, text=True)
+    if p.returncode == 0:
+        return [Result.PASS] * len(configs)
+    mid = len(configs) // 2
+    return check_batch(
+        configs[:mid], miniwdl_path, test_dir, strict, no_warn, deprecated_optional
+    ) + check_batch(
+        configs[mid:], miniwdl_path, test_dir, strict, no_warn, deprecated_optional
+    )
+
+
 def run_test(
     config: dict,
-    miniwdl_path: Path,
-    test_dir: Path,
+    miniwdl_path: str,
+    test_dir: str,
     data_dir: Path,
-    output_dir: Optional[Path],
+    output_dir: Optional[str],
     no_warn: bool,
     deprecated_optional: bool,
 ) -> Result:
     if config["priority"] == "ignore":
         return Result.IGNORE
 
-    input_json = json.dumps(config["input"])
-    command = [miniwdl_path, "run", "-p", test_dir, "-i", input_json]
+    command = [miniwdl_path, "run", "-p", test_dir, "-i", config["_input_json"]]
+    outputs_file = None
     if output_dir is not None:
-        command.extend(["-d", str(output_dir)])
+        # Have miniwdl write its result document to a file rather than capturing it from
+        # stdout; it is only read if the outputs need to be checked. Several tests can share
+        # an id (e.g. foo.wdl and foo_fail.wdl), so files are named after the test's file.
+        name = Path(config["path"]).stem
+        outputs_file = os.path.join(output_dir, f"{name}.outputs.json")
+        command.extend(["-d", os.path.join(output_dir, name), "-o", outputs_file])
+        # Remove the file left by any previous run into the same output directory, so a
+        # missing file means this run wrote no outputs
+        try:
+            os.unlink(outputs_file)
+        except FileNotFoundError:
+            pass
     if config["type"] == "task":
         command.extend(["--task", str(config["target"])])
     command.append(str(config["path"]))
-    p = subby.cmd(command, shell=True, cwd=data_dir)
-    output = json.loads(p.output)
+    log.debug("Executing: %s", command)
+    # Output is kept as bytes, which load_json parses without decoding it first
+    p = subprocess.run(command, cwd=data_dir, capture_output=True)
 
     fail = False
     if p.returncode == 0:
@@ -99,13 +156,23 @@ def run_test(
         fail = True
 
     invalid = []
-    if not fail:
-        for key, value in output.items():
-            if key not in config["exclude_output"]:
-                if key not in config["output"]:
-                    invalid.append((key, value, None))
-                elif config["output"][key] != value:
-                    invalid.append((key, value, config["output"][key]))
+    missing_outputs = False
+    # Only parse and compare outputs if the test declares any
+    if not fail and config.get("output"):
+        result = p.stdout
+        if outputs_file is not None:
+            try:
+                with open(outputs_file, "rb") as i:
+                    result = i.read()
+            except FileNotFoundError:
+                # miniwdl writes the file whenever it succeeds, so only an expected
+                # failure may leave it missing
+                result = b""
+                if p.returncode == 0:
+                    fail = missing_outputs = True
+        if not fail:
+            output = load_json(result).get("outputs", {}) if result.strip() else {}
+            invalid = find_invalid_outputs(output, config)
 
     if fail or invalid:
         warn = config["priority"] == "optional"
@@ -113,15 +180,16 @@ def run_test(
             return Result.WARN
 
         title = f"{config['path']}: {'WARNING' if warn else 'ERROR'}"
-        print(title)
-        print("-" * len(title))
-        print(f"Return code:")
-        if fail:
-            print(json.dumps(output))
+        report = [title, "-" * len(title), f"Return code: {p.returncode}"]
+        if missing_outputs:
+            report.append(f"Outputs file not written: {outputs_file}")
+        elif fail:
+            report.append((p.stdout or p.stderr).decode(errors="replace"))
         else:
-            print("Invalid output(s):")
-            for key, expected, actual in invalid:
-                print(f"  {key}: {expected} != {actual}")
+            report.append("Invalid output(s):")
+            for key, actual, expected in invalid:
+                report.append(f"  {key}: actual {actual} != expected {expected}")
+        print("\n".join(report))
 
         if warn:
             return Result.WARN
@@ -134,57 +202,73 @@ def run_test(
 
 
 def main():
-    parser = ArgumentParser()
-    parser.add_argument("-T", "--test-dir", type=Path, default=Path("."))
-    parser.add_argument("-c", "--test-config", type=Path, default=None)
-    parser.add_argument("-D", "--data-dir", type=Path, default=None)
-    parser.add_argument("-O", "--output-dir", type=Path, default=None)
-    parser.add_argument("-n", "--num-tests", type=int, default=None)
+    parser = build_argparser()
     parser.add_argument("--miniwdl-path", type=Path, default=None)
-    parser.add_argument("--check-only", action="store_true", default=False)
-    parser.add_argument("--strict", action="store_true", default=False)
-    parser.add_argument("--no-warn", action="store_true", default=False)
-    parser.add_argument("--deprecated-optional", action="store_true", default=False)
     args = parser.parse_args()
 
+    configure_logging(args.verbose)
+
     miniwdl_path = resolve_miniwdl(args.miniwdl_path)
     test_dir = args.test_dir
     data_dir = args.data_dir or test_dir / "data"
     test_config = args.test_config or test_dir / "test_config.json"
-    with open(test_config, "r") as i:
-        configs = json.load(i)
+    configs = load_configs(test_config)
     if args.num_tests is not None:
         configs = configs[: args.num_tests]
-    results = defaultdict(int)
-    for config in configs:
-        if args.check_only:
-            result = check(
-                config,
-                miniwdl_path,
-                test_dir,
-                args.strict,
-                args.no_warn,
-                args.deprecated_optional,
-            )
-            results[result] += 1
-        else:
-            result = run_test(
-                config,
-                miniwdl_path,
-                test_dir,
-                data_dir,
-                args.output_dir,
-                args.no_warn,
-                args.deprecated_optional,
-            )
-            results[result] += 1
-
-    print(f"Total tests: {sum(results.values())}")
-    print(f"Passed: {results.get(Result.PASS, 0)}")
-    print(f"Warnings: {results.get(Result.WARN, 0)}")
-    print(f"Failures: {results.get(Result.FAIL, 0)}")
-    print(f"Invalid outputs: {results.get(Result.INVALID, 0)}")
-    print(f"Ignored: {results.get(Result.IGNORE, 0)}")
+    if not args.check_only:
+        for config in configs:
+            config["_input_json"] = dump_json(config.get("input") or {})
+
+    # Convert paths that are the same for every test to strings once. Tests run with the test
+    # or data directory as their working directory, so these must be absolute paths.
+    miniwdl_s = str(miniwdl_path.absolute())
+    test_dir_s = str(test_dir.resolve())
+    output_dir_s = None
+    if args.output_dir is not None:
+        output_dir_s = str(args.output_dir.resolve())
+        os.makedirs(output_dir_s, exist_ok=True)
+
+    if args.check_only:
+        # Files that are expected to fail are checked on their own, since they would make
+        # any batch containing them fail. The rest are batched, using smaller batches if
+        # needed to keep all the workers busy.
+        batches = []
+        batchable = []
+        for config in configs:
+            if config["fail"] or config["priority"] == "ignore":
+                batches.append([config])
+            else:
+                batchable.append(config)
+        batch_size = max(
+            1, min(CHECK_BATCH_SIZE, math.ceil(len(batchable) / (args.jobs or 1)))
+        )
+        batches.extend(
+            batchable[i : i + batch_size] for i in range(0, len(batchable), batch_size)
+        )
+        test_fn = functools.partial(
+            check_batch,
+            miniwdl_path=miniwdl_s,
+            test_dir=test_dir_s,
+            strict=args.strict,
+            no_warn=args.no_warn,
+            deprecated_optional=args.deprecated_optional,
+        )
+    else:
+        run_one = functools.partial(
+            run_test,
+            miniwdl_path=miniwdl_s,
+            test_dir=test_dir_s,
+            data_dir=data_dir,
+            output_dir=output_dir_s,
+            no_warn=args.no_warn,
+            deprecated_optional=args.deprecated_optional,
+        )
+        batches = [[c] for c in configs]
+
+        def test_fn(batch: List[dict]) -> List[Result]:
+            return [run_one(config) for config in batch]
+
+    summarize(run_suite(batches, test_fn, args.jobs))
 
 
 if __name__ == "__main__":